@@ -0,0 +1,352 @@
+import pandas as pd
+import numpy as np
+from openpyxl import load_workbook
+import os
+
+
+def load_dataset(archivo_excel, columnas, hoja='Dataset', usar_cache=True):
+    """
+    Carga las columnas indicadas de la hoja "Dataset", usando una caché Parquet
+
+    La primera lectura parsea el Excel y guarda las columnas leídas en
+    '<archivo_excel>.parquet'. Las siguientes lecturas usan ese archivo mientras
+    sea más reciente que el Excel (mapeado en memoria, sin copiarlo a un buffer
+    intermedio); si falta alguna columna, solo esa se lee del Excel y se agrega
+    a la caché. La caché se reemplaza de forma atómica, y si no coincide con el
+    Excel se vuelve a armar con todas las columnas requeridas.
+
+    Args:
+        archivo_excel (str): Ruta del archivo Excel a leer
+        columnas (list): Nombres de las columnas requeridas
+        hoja (str): Nombre de la hoja a leer (si no existe se usa la segunda hoja)
+        usar_cache (bool): Si se debe leer y actualizar la caché Parquet
+
+    Returns:
+        pd.DataFrame: DataFrame con las columnas requeridas, o None si hubo un error
+    """
+
+    archivo_cache = archivo_excel + '.parquet'
+    columnas_cache = cached_columns(archivo_excel) if usar_cache else []
+
+    if columnas_cache and all(columna in columnas_cache for columna in columnas):
+        try:
+            return pd.read_parquet(archivo_cache, columns=columnas, memory_map=True)
+        except Exception as e:
+            print(f"⚠️  No se pudo leer la caché Parquet, se leerá el Excel: {e}")
+            columnas_cache = []
+
+    # Leer del Excel solo las columnas que no están en la caché
+    faltantes = [c for c in columnas if c not in columnas_cache]
+    df = read_excel_columns(archivo_excel, faltantes, hoja)
+    if df is None:
+        return None
+
+    if columnas_cache:
+        try:
+            df_cache = pd.read_parquet(archivo_cache, memory_map=True)
+        except Exception as e:
+            print(f"⚠️  No se pudo leer la caché Parquet, se leerá el Excel: {e}")
+            df_cache = None
+
+        if df_cache is not None and len(df_cache) == len(df):
+            df = pd.concat([df_cache, df], axis=1)
+        else:
+            # La caché no corresponde al Excel: leer todas las columnas y reemplazarla
+            if df_cache is not None:
+                print("⚠️  La caché Parquet no coincide con el Excel, se leerán todas las columnas")
+            df = read_excel_columns(archivo_excel, columnas, hoja)
+            if df is None:
+                return None
+
+    # Las columnas con tipos mezclados (p. ej. IDs numéricos y de texto, o números con
+    # algún texto suelto) no se pueden guardar en Parquet: se pasan a texto, que es como
+    # las usa el análisis (luego se convierten a número donde hace falta)
+    for columna in df.columns:
+        if df[columna].dtype == object and pd.api.types.infer_dtype(df[columna], skipna=True) in (
+                'mixed', 'mixed-integer'):
+            df[columna] = df[columna].astype('string[pyarrow]')
+
+    if usar_cache:
+        # Escribir en un archivo temporal y reemplazar la caché de una sola vez, para
+        # que otro proceso nunca lea una caché a medio escribir
+        archivo_temporal = f'{archivo_cache}.{os.getpid()}.tmp'
+        try:
+            df.to_parquet(archivo_temporal, compression='zstd', index=False)
+            os.replace(archivo_temporal, archivo_cache)
+        except Exception as e:
+            print(f"⚠️  No se pudo guardar la caché Parquet: {e}")
+            if os.path.exists(archivo_temporal):
+                os.remove(archivo_temporal)
+
+    return df[columnas]
+
+
+def cached_columns(archivo_excel):
+    """
+    Devuelve las columnas guardadas en la caché Parquet de un archivo Excel
+
+    Args:
+        archivo_excel (str): Ruta del archivo Excel
+
+    Returns:
+        list: Columnas de la caché, o una lista vacía si no existe, no se puede leer
+        o es más antigua que el Excel
+    """
+
+    archivo_cache = archivo_excel + '.parquet'
+
+    # Usar la caché solo si es más reciente que el Excel
+    if not (os.path.exists(archivo_cache)
+            and os.path.getmtime(archivo_cache) >= os.path.getmtime(archivo_excel)):
+        return []
+
+    try:
+        import pyarrow.parquet as pq
+        return pq.read_schema(archivo_cache).names
+    except Exception as e:
+        print(f"⚠️  No se pudo leer la caché Parquet, se leerá el Excel: {e}")
+        return []
+
+
+def load_cleaned_dataset(archivo_excel, columnas, categoricas=(), numericas=(), descartar_vacios=True,
+                         usar_cache=True):
+    """
+    Carga las columnas indicadas con load_dataset y las deja limpias para analizar
+
+    Las columnas de texto se convierten a strings de Arrow sin espacios al
+    inicio y al final, las numéricas a números (los valores inválidos quedan
+    nulos), se eliminan las filas con nulos y, al final, las columnas
+    categóricas se convierten a 'category' para agrupar por códigos enteros.
+
+    Args:
+        archivo_excel (str): Ruta del archivo Excel a leer
+        columnas (list): Nombres de las columnas requeridas
+        categoricas (tuple): Columnas a convertir a 'category'
+        numericas (tuple): Columnas a convertir a número
+        descartar_vacios (bool): Si se eliminan las filas con textos vacíos
+        usar_cache (bool): Si se debe leer y actualizar la caché Parquet
+
+    Returns:
+        pd.DataFrame: DataFrame limpio, o None si hubo un error
+    """
+
+    df = load_dataset(archivo_excel, columnas, usar_cache=usar_cache)
+    if df is None:
+        return None
+
+    textos = [c for c in columnas if c not in numericas]
+    for columna in columnas:
+        if columna in numericas:
+            valores = df[columna]
+            if isinstance(valores.dtype, pd.StringDtype):
+                # Columna con textos sueltos que se guardó como texto: se convierte
+                # desde object para obtener números de NumPy y no tipos anulables
+                valores = valores.astype(object)
+            df[columna] = pd.to_numeric(valores, errors='coerce')
+        else:
+            df[columna] = df[columna].astype('string[pyarrow]').str.strip()
+
+    # Descartar nulos (y vacíos) con una sola máscara, filtrando el DataFrame una vez
+    validos = df.notna().all(axis=1)
+    if descartar_vacios and textos:
+        validos &= (df[textos] != '').all(axis=1)
+    df = df[validos]
+
+    if categoricas:
+        df = df.astype({columna: 'category' for columna in categoricas})
+
+    return df
+
+
+def read_excel_columns(archivo_excel, columnas, hoja='Dataset'):
+    """
+    Lee únicamente las columnas indicadas de la hoja "Dataset" de un archivo Excel
+
+    Usa openpyxl en modo de solo lectura, recorriendo las filas en streaming y
+    conservando solo los valores de las columnas requeridas.
+
+    Args:
+        archivo_excel (str): Ruta del archivo Excel a leer
+        columnas (list): Nombres de las columnas requeridas
+        hoja (str): Nombre de la hoja a leer (si no existe se usa la segunda hoja)
+
+    Returns:
+        pd.DataFrame: DataFrame con las columnas requeridas, o None si hubo un error
+    """
+
+    try:
+        workbook = load_workbook(archivo_excel, read_only=True, data_only=True)
+    except Exception as e:
+        print(f"❌ Error al leer el archivo Excel: {e}")
+        return None
+
+    try:
+        # Elegir la hoja sin parsear celdas (solo metadatos del libro)
+        if hoja in workbook.sheetnames:
+            worksheet = workbook[hoja]
+        elif len(workbook.worksheets) > 1:
+            worksheet = workbook.worksheets[1]
+            print(f"⚠️  Hoja '{hoja}' no encontrada, usando la segunda hoja del archivo")
+        else:
+            print(f"❌ Error al leer el archivo Excel: no existe la hoja '{hoja}' ni una segunda hoja")
+            return None
+
+        # Recalcular el rango de la hoja en lugar de confiar en la etiqueta <dimension>
+        # del XML (algunos programas la escriben desactualizada y se perderían filas)
+        worksheet.reset_dimensions()
+        filas = worksheet.iter_rows(values_only=True)
+        encabezado = list(next(filas, ()))
+
+        # Verificar si existen las columnas necesarias
+        for columna in columnas:
+            if columna not in encabezado:
+                print(f"❌ Error: No se encontró la columna '{columna}' en la hoja")
+                print(f"Columnas disponibles: {[c for c in encabezado if c is not None]}")
+                return None
+
+        # Proyectar solo las columnas requeridas mientras se leen las filas
+        indices = [encabezado.index(columna) for columna in columnas]
+        datos = [[] for _ in columnas]
+        for fila in filas:
+            for valores, indice in zip(datos, indices):
+                valores.append(fila[indice] if indice < len(fila) else None)
+
+        return pd.DataFrame(dict(zip(columnas, datos)))
+
+    except Exception as e:
+        print(f"❌ Error al leer el archivo Excel: {e}")
+        return None
+
+    finally:
+        workbook.close()
+
+
+def top_n(df, columna, n=20):
+    """
+    Obtiene las n filas con mayor valor en una columna, igual que df.nlargest(n, columna)
+
+    Selecciona las candidatas con una partición parcial (O(N)) y ordena solo
+    esas; a igual valor se conserva el orden original de las filas.
+
+    Args:
+        df (pd.DataFrame): DataFrame de origen (sin valores nulos en la columna)
+        columna (str): Nombre de la columna por la que se ordena
+        n (int): Cantidad de filas a obtener
+
+    Returns:
+        pd.DataFrame: Las n filas con mayor valor, en orden descendente
+    """
+
+    valores = df[columna].to_numpy()
+    if len(valores) <= n:
+        return df.sort_values(columna, ascending=False, kind='stable')
+
+    # Valor del n-ésimo mayor; todas las filas con un valor igual o mayor son candidatas
+    umbral = np.partition(valores, len(valores) - n)[len(valores) - n]
+    candidatas = np.flatnonzero(valores >= umbral)
+    orden = np.argsort(-valores[candidatas], kind='stable')[:n]
+    return df.iloc[candidatas[orden]]
+
+
+def column_widths(df, ancho_maximo=50):
+    """
+    Calcula el ancho de cada columna de un DataFrame para mostrarlo en Excel
+
+    Los anchos se calculan con operaciones vectorizadas de pandas sobre el
+    DataFrame (valor más largo o encabezado + 2), sin recorrer celdas.
+
+    Args:
+        df (pd.DataFrame): DataFrame a escribir
+        ancho_maximo (int): Ancho máximo permitido por columna
+
+    Returns:
+        list: Ancho de cada columna, en el orden de df.columns
+    """
+
+    anchos = []
+    for columna in df.columns:
+        largo = df[columna].astype(str).str.len().max()
+        largo = max(0 if pd.isna(largo) else int(largo), len(str(columna)))
+        anchos.append(min(largo + 2, ancho_maximo))
+    return anchos
+
+
+def excel_writer(archivo_salida):
+    """
+    Crea un ExcelWriter de xlsxwriter en modo de memoria constante
+
+    En este modo cada fila se escribe a disco apenas se completa, por lo que
+    las hojas deben escribirse fila por fila con write_sheet.
+
+    Args:
+        archivo_salida (str): Nombre del archivo Excel de salida
+
+    Returns:
+        pd.ExcelWriter: Writer a usar dentro de un bloque with
+    """
+
+    return pd.ExcelWriter(archivo_salida, engine='xlsxwriter',
+                          engine_kwargs={'options': {'constant_memory': True}})
+
+
+def write_sheet(writer, df, nombre_hoja, ancho_maximo=50, index=False):
+    """
+    Escribe un DataFrame en una hoja nueva, fila por fila y con los anchos ya ajustados
+
+    Los anchos se fijan antes de escribir los datos, como exige el modo de
+    memoria constante de xlsxwriter (no se pueden modificar filas ya escritas).
+
+    Args:
+        writer (pd.ExcelWriter): Writer creado con excel_writer
+        df (pd.DataFrame): DataFrame a escribir
+        nombre_hoja (str): Nombre de la hoja
+        ancho_maximo (int): Ancho máximo permitido por columna
+        index (bool): Si se escribe el índice como primera columna
+
+    Returns:
+        Worksheet: Hoja de xlsxwriter creada
+    """
+
+    datos = df.reset_index() if index else df
+    worksheet = writer.book.add_worksheet(nombre_hoja)
+
+    for i, ancho in enumerate(column_widths(datos, ancho_maximo)):
+        worksheet.set_column(i, i, ancho)
+
+    formato_encabezado = writer.book.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+    worksheet.write_row(0, 0, [str(columna) for columna in datos.columns], formato_encabezado)
+
+    # Los valores nulos se escriben como celdas vacías
+    valores = datos.astype(object).where(datos.notna(), None)
+    for fila, registro in enumerate(valores.itertuples(index=False, name=None), 1):
+        worksheet.write_row(fila, 0, registro)
+
+    return worksheet
+
+
+def insert_image(worksheet, celda, imagen, ancho, alto):
+    """
+    Inserta una imagen PNG en una hoja de xlsxwriter con un tamaño fijo en píxeles
+
+    Args:
+        worksheet: Hoja de xlsxwriter donde se inserta la imagen
+        celda (str): Celda de la esquina superior izquierda (por ejemplo 'D2')
+        imagen (io.BytesIO): Buffer con la imagen en formato PNG
+        ancho (int): Ancho con el que se muestra la imagen, en píxeles
+        alto (int): Alto con el que se muestra la imagen, en píxeles
+    """
+
+    from PIL import Image
+
+    # xlsxwriter escala según el tamaño y los DPI propios de la imagen
+    imagen.seek(0)
+    with Image.open(imagen) as img:
+        ancho_img, alto_img = img.size
+        dpi_x, dpi_y = img.info.get('dpi', (96, 96))
+
+    imagen.seek(0)
+    worksheet.insert_image(celda, 'grafico.png', {
+        'image_data': imagen,
+        'x_scale': ancho / (ancho_img * 96 / dpi_x),
+        'y_scale': alto / (alto_img * 96 / dpi_y)
+    })
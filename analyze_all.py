@@ -0,0 +1,102 @@
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+import io
+import os
+
+from analysis_common import cached_columns, load_dataset
+from dataset_exam_customers import analizar_customer_ids
+from dataset_exam_devices import analizar_dispositivos_por_cliente
+from dataset_exam_genre import analizar_generos_y_grafico
+from dataset_exam_region_genre_relation import analizar_relacion_region_genero
+from dataset_exam_screentime_visualizations import analizar_recurrencia_consumo
+from dataset_exam_top_shows import analizar_shows_por_visualizaciones
+
+# Analizadores a ejecutar y columnas del dataset que necesita cada uno
+ANALIZADORES = [
+    (analizar_customer_ids, ['CUSTOMER_ID']),
+    (analizar_dispositivos_por_cliente, ['CUSTOMER_ID', 'DEVICE']),
+    (analizar_generos_y_grafico, ['GENRE']),
+    (analizar_relacion_region_genero, ['REGION', 'GENRE']),
+    (analizar_recurrencia_consumo, ['CUSTOMER_ID', 'SCREENTIME']),
+    (analizar_shows_por_visualizaciones, ['TITLE', 'GENRE']),
+]
+
+
+def _ejecutar_analizador(analizador, archivo_excel):
+    """
+    Ejecuta un analizador capturando lo que imprime en consola
+
+    Args:
+        analizador (callable): Función de análisis a ejecutar
+        archivo_excel (str): Ruta del archivo Excel de entrada
+
+    Returns:
+        str: Salida de consola del analizador
+    """
+
+    salida = io.StringIO()
+    with contextlib.redirect_stdout(salida):
+        analizador(archivo_excel)
+    return salida.getvalue()
+
+
+def analizar_todo(archivo_excel):
+    """
+    Ejecuta todos los analizadores sobre un archivo Excel en procesos paralelos
+
+    El Excel se parsea una sola vez para llenar la caché Parquet; cada proceso
+    lee después sus columnas desde esa caché. Si la caché no se pudo guardar no
+    se lanzan los procesos, ya que cada uno volvería a parsear el Excel.
+
+    Args:
+        archivo_excel (str): Ruta del archivo Excel de entrada
+    """
+
+    # Verificar si el archivo existe
+    if not os.path.exists(archivo_excel):
+        print(f"❌ Error: El archivo '{archivo_excel}' no existe.")
+        return
+
+    # Leer una sola vez todas las columnas necesarias para dejar lista la caché
+    columnas = []
+    for _, columnas_analizador in ANALIZADORES:
+        columnas += [c for c in columnas_analizador if c not in columnas]
+    try:
+        if load_dataset(archivo_excel, columnas) is None:
+            return
+    except Exception as e:
+        print(f"❌ Error inesperado al leer el archivo Excel: {e}")
+        return
+
+    if not all(columna in cached_columns(archivo_excel) for columna in columnas):
+        print("❌ Error: No se pudo preparar la caché Parquet; ejecute los analizadores por separado.")
+        return
+
+    # Ejecutar los análisis en paralelo y mostrar sus salidas en orden
+    with ProcessPoolExecutor(max_workers=len(ANALIZADORES)) as executor:
+        futuros = [executor.submit(_ejecutar_analizador, analizador, archivo_excel)
+                   for analizador, _ in ANALIZADORES]
+        for futuro in futuros:
+            print(futuro.result())
+
+
+def main():
+    """Función principal"""
+
+    print("🚀 EJECUTAR TODOS LOS ANALIZADORES")
+    print("=" * 50)
+
+    # Solicitar la ruta del archivo Excel
+    archivo = input("Ingrese la ruta del archivo Excel: ").strip().strip('"')
+
+    if not archivo:
+        print("❌ Debe ingresar una ruta válida")
+        return
+
+    # Ejecutar los análisis
+    analizar_todo(archivo)
+
+
+# Ejecutar el script directamente
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,8 @@
 import pandas as pd
-from collections import Counter
 import os
 
+from analysis_common import load_dataset
+
 
 def analizar_customer_ids(archivo_excel):
     """
@@ -17,30 +18,23 @@ def analizar_customer_ids(archivo_excel):
             print(f"❌ Error: El archivo '{archivo_excel}' no existe.")
             return
 
-        # Leer la segunda hoja (índice 1) llamada "Dataset"
-        try:
-            df = pd.read_excel(archivo_excel, sheet_name='Dataset')
-        except:
-            # Si no encuentra por nombre, intentar por índice (segunda hoja)
-            try:
-                df = pd.read_excel(archivo_excel, sheet_name=1)
-                print("⚠️  Hoja 'Dataset' no encontrada, usando la segunda hoja del archivo")
-            except Exception as e:
-                print(f"❌ Error al leer el archivo Excel: {e}")
-                return
-
-        # Verificar si existe la columna CUSTOMER_ID
-        if 'CUSTOMER_ID' not in df.columns:
-            print("❌ Error: No se encontró la columna 'CUSTOMER_ID' en la hoja")
-            print(f"Columnas disponibles: {list(df.columns)}")
+        # Leer solo la columna CUSTOMER_ID de la hoja "Dataset"
+        df = load_dataset(archivo_excel, ['CUSTOMER_ID'])
+        if df is None:
             return
 
-        # Obtener todos los CUSTOMER_ID (eliminando valores nulos)
-        customer_ids = df['CUSTOMER_ID'].dropna().astype(str)
+        # Contar repeticiones por CUSTOMER_ID (en orden de aparición, eliminando valores nulos)
+        frecuencias = df['CUSTOMER_ID'].value_counts(sort=False)
+
+        # Convertir a texto una sola vez por ID distinto, no por registro; valores
+        # distintos con el mismo texto (p. ej. 1 y '1') se suman en un solo ID
+        frecuencias.index = frecuencias.index.astype(str)
+        if not frecuencias.index.is_unique:
+            frecuencias = frecuencias.groupby(level=0, sort=False).sum()
 
         # Contar total de registros y valores únicos
-        total_registros = len(customer_ids)
-        total_unicos = customer_ids.nunique()
+        total_registros = int(frecuencias.sum())
+        total_unicos = len(frecuencias)
 
         print("=" * 50)
         print("📊 ANÁLISIS DE CUSTOMER_ID")
@@ -50,18 +44,15 @@ def analizar_customer_ids(archivo_excel):
         print(f"🔄 Registros duplicados: {total_registros - total_unicos}")
         print("=" * 50)
 
-        # Encontrar duplicados y contar repeticiones
-        contador = Counter(customer_ids)
-        duplicados = {k: v for k, v in contador.items() if v > 1}
+        # Encontrar duplicados, ordenados por cantidad de repeticiones (descendente;
+        # a igual cantidad se conserva el orden de aparición)
+        duplicados = frecuencias[frecuencias > 1].sort_values(ascending=False, kind='stable')
 
-        if duplicados:
+        if len(duplicados) > 0:
             print("🔍 CUSTOMER_IDs DUPLICADOS:")
             print("=" * 50)
 
-            # Ordenar por cantidad de repeticiones (descendente)
-            duplicados_ordenados = sorted(duplicados.items(), key=lambda x: x[1], reverse=True)
-
-            for customer_id, count in duplicados_ordenados:
+            for customer_id, count in duplicados.items():
                 print(f"• {customer_id}: se repite {count} veces")
 
             print("=" * 50)
@@ -72,8 +63,7 @@ def analizar_customer_ids(archivo_excel):
         # Mostrar algunos ejemplos únicos (si hay muchos)
         if total_unicos > 0:
             print(f"\n🔹 Primeros 5 CUSTOMER_IDs únicos (ejemplo):")
-            unicos = customer_ids.unique()
-            for i, uid in enumerate(unicos[:5]):
+            for i, uid in enumerate(frecuencias.index[:5]):
                 print(f"  {i + 1}. {uid}")
 
             if total_unicos > 5:
@@ -90,9 +80,9 @@ def analizar_customer_ids(archivo_excel):
         try:
             # Crear DataFrame con los resultados
             resultados = pd.DataFrame({
-                'CUSTOMER_ID': list(contador.keys()),
-                'FRECUENCIA': list(contador.values()),
-                'ES_DUPLICADO': [v > 1 for v in contador.values()]
+                'CUSTOMER_ID': frecuencias.index,
+                'FRECUENCIA': frecuencias.values,
+                'ES_DUPLICADO': frecuencias.values > 1
             })
 
             # Guardar en CSV
@@ -1,7 +1,67 @@
 import pandas as pd
-from collections import defaultdict
+import numpy as np
 import os
 
+from analysis_common import excel_writer, load_cleaned_dataset, write_sheet
+
+
+def _mascaras_dispositivos(codigos_cliente, codigos_dispositivo, n_clientes):
+    """
+    Calcula en una sola pasada los dispositivos usados y el total de registros por cliente
+
+    Cada cliente se representa con una máscara de bits (uint64) en la que el
+    bit i indica que usó el dispositivo con código i, por lo que admite hasta
+    64 dispositivos distintos.
+
+    Args:
+        codigos_cliente (np.ndarray): Código entero del cliente de cada registro
+        codigos_dispositivo (np.ndarray): Código entero del dispositivo de cada registro
+        n_clientes (int): Cantidad de clientes distintos
+
+    Returns:
+        tuple: (máscaras de bits por cliente, total de registros por cliente)
+    """
+
+    bits = np.left_shift(np.uint64(1), codigos_dispositivo.astype(np.uint64))
+    mascaras = np.zeros(n_clientes, dtype=np.uint64)
+    np.bitwise_or.at(mascaras, codigos_cliente, bits)
+    totales = np.bincount(codigos_cliente, minlength=n_clientes)
+    return mascaras, totales
+
+
+def _tramos_dispositivos(codigos_cliente, codigos_dispositivo, nombres):
+    """
+    Calcula los dispositivos por cliente ordenando los pares y recorriéndolos por tramos
+
+    Alternativa a las máscaras de bits cuando hay más de 64 dispositivos: los
+    pares (cliente, dispositivo) codificados como un solo entero se ordenan, y
+    cada cliente queda como un tramo contiguo de dispositivos ya ordenados.
+
+    Args:
+        codigos_cliente (np.ndarray): Código entero del cliente de cada registro
+        codigos_dispositivo (np.ndarray): Código entero del dispositivo de cada registro
+        nombres (np.ndarray): Nombre de cada dispositivo, indexado por su código
+
+    Returns:
+        tuple: (cantidad de dispositivos, total de registros y lista de dispositivos
+        por cliente, cantidad de clientes por dispositivo)
+    """
+
+    n_dispositivos = len(nombres)
+    claves = codigos_cliente.astype(np.int64) * n_dispositivos + codigos_dispositivo
+    claves_unicas, conteos_pares = np.unique(claves, return_counts=True)
+    cliente_par, dispositivo_par = np.divmod(claves_unicas, n_dispositivos)
+
+    # Inicio y fin del tramo de cada cliente dentro de los pares ordenados
+    inicios = np.flatnonzero(np.r_[True, cliente_par[1:] != cliente_par[:-1]])
+    fines = np.r_[inicios[1:], len(cliente_par)]
+
+    cantidades = fines - inicios
+    totales = np.add.reduceat(conteos_pares, inicios)
+    listas = np.array([', '.join(nombres[dispositivo_par[i:j]]) for i, j in zip(inicios, fines)], dtype=object)
+    clientes_por_dispositivo = np.bincount(dispositivo_par, minlength=n_dispositivos)
+    return cantidades, totales, listas, clientes_por_dispositivo
+
 
 def analizar_dispositivos_por_cliente(archivo_excel, archivo_salida="analisis_dispositivos.xlsx"):
     """
@@ -18,63 +78,53 @@ def analizar_dispositivos_por_cliente(archivo_excel, archivo_salida="analisis_di
             print(f"❌ Error: El archivo '{archivo_excel}' no existe.")
             return None
 
-        # Leer la hoja "Dataset"
-        try:
-            df = pd.read_excel(archivo_excel, sheet_name='Dataset')
-        except:
-            # Si no encuentra por nombre, intentar por índice (segunda hoja)
-            try:
-                df = pd.read_excel(archivo_excel, sheet_name=1)
-                print("⚠️  Hoja 'Dataset' no encontrada, usando la segunda hoja del archivo")
-            except Exception as e:
-                print(f"❌ Error al leer el archivo Excel: {e}")
-                return None
-
-        # Verificar si existen las columnas necesarias
-        columnas_requeridas = ['CUSTOMER_ID', 'DEVICE']
-        for columna in columnas_requeridas:
-            if columna not in df.columns:
-                print(f"❌ Error: No se encontró la columna '{columna}' en la hoja")
-                print(f"Columnas disponibles: {list(df.columns)}")
-                return None
-
-        # Limpiar y preparar los datos
-        df_clean = df[['CUSTOMER_ID', 'DEVICE']].copy()
-        df_clean['CUSTOMER_ID'] = df_clean['CUSTOMER_ID'].astype(str).str.strip()
-        df_clean['DEVICE'] = df_clean['DEVICE'].astype(str).str.strip()
-        df_clean = df_clean.dropna()
-
-        # Crear diccionario para almacenar dispositivos por cliente
-        clientes_dispositivos = defaultdict(set)
-        clientes_registros = defaultdict(list)
-
-        # Procesar cada registro
-        for _, row in df_clean.iterrows():
-            customer_id = row['CUSTOMER_ID']
-            device = row['DEVICE']
-
-            clientes_dispositivos[customer_id].add(device)
-            clientes_registros[customer_id].append(device)
-
-        # Crear DataFrame con el análisis
-        analisis_data = []
-
-        for customer_id, dispositivos in clientes_dispositivos.items():
-            cantidad_dispositivos = len(dispositivos)
-            lista_dispositivos = ', '.join(sorted(dispositivos))
-            total_registros = len(clientes_registros[customer_id])
-
-            analisis_data.append({
-                'CUSTOMER_ID': customer_id,
-                'CANTIDAD_DISPOSITIVOS': cantidad_dispositivos,
-                'DISPOSITIVOS_UTILIZADOS': lista_dispositivos,
-                'USA_MULTIPLES_DISPOSITIVOS': 'Sí' if cantidad_dispositivos > 1 else 'No',
-                'TOTAL_VISUALIZACIONES': total_registros,
-                'DISP_UNICOS/TOTAL': f"{cantidad_dispositivos}/{total_registros}"
-            })
+        # Leer y limpiar las columnas necesarias (como categorías, para agrupar por códigos enteros)
+        df_clean = load_cleaned_dataset(archivo_excel, ['CUSTOMER_ID', 'DEVICE'],
+                                        categoricas=('CUSTOMER_ID', 'DEVICE'), descartar_vacios=False)
+        if df_clean is None:
+            return None
 
-        # Crear DataFrame principal
-        df_analisis = pd.DataFrame(analisis_data)
+        clientes = df_clean['CUSTOMER_ID'].cat
+        dispositivos = df_clean['DEVICE'].cat
+        codigos_cliente = clientes.codes.to_numpy()
+        codigos_dispositivo = dispositivos.codes.to_numpy()
+        nombres = dispositivos.categories.to_numpy()
+
+        if len(nombres) <= 64:
+            # Máscara de bits de dispositivos por cliente sobre los códigos enteros
+            mascaras, totales_cod = _mascaras_dispositivos(codigos_cliente, codigos_dispositivo,
+                                                           len(clientes.categories))
+
+            # Traducir cada máscara distinta (son pocas) a cantidad y lista de dispositivos
+            mascaras_unicas, inversa = np.unique(mascaras, return_inverse=True)
+            bits_usados = (mascaras_unicas[:, None] >> np.arange(len(nombres), dtype=np.uint64)) & 1
+            bits_usados = bits_usados.astype(bool)
+            cantidades_cod = bits_usados.sum(axis=1)[inversa]
+            listas_cod = np.array([', '.join(nombres[usados]) for usados in bits_usados], dtype=object)[inversa]
+            clientes_por_dispositivo = np.bincount(inversa, minlength=len(mascaras_unicas)) @ bits_usados
+        else:
+            # Demasiados dispositivos para una máscara: ordenar los pares y recorrerlos por tramos
+            cantidades_cod, totales_cod, listas_cod, clientes_por_dispositivo = _tramos_dispositivos(
+                codigos_cliente, codigos_dispositivo, nombres)
+
+        # Conservar el orden de aparición de los clientes
+        orden = pd.unique(codigos_cliente)
+        indice_clientes = clientes.categories[orden]
+        totales = pd.Series(totales_cod[orden], index=indice_clientes)
+        cantidades = pd.Series(cantidades_cod[orden], index=indice_clientes)
+        listas = pd.Series(listas_cod[orden], index=indice_clientes)
+        dispositivo_counts = pd.Series(clientes_por_dispositivo, index=nombres).sort_values(
+            ascending=False, kind='stable')
+
+        # Crear DataFrame principal con el análisis
+        df_analisis = pd.DataFrame({
+            'CUSTOMER_ID': totales.index,
+            'CANTIDAD_DISPOSITIVOS': cantidades.values,
+            'DISPOSITIVOS_UTILIZADOS': listas.values,
+            'USA_MULTIPLES_DISPOSITIVOS': np.where(cantidades.values > 1, 'Sí', 'No'),
+            'TOTAL_VISUALIZACIONES': totales.values,
+            'DISP_UNICOS/TOTAL': (cantidades.astype(str) + '/' + totales.astype(str)).values
+        })
 
         # Ordenar por cantidad de dispositivos (descendente)
         df_analisis = df_analisis.sort_values('CANTIDAD_DISPOSITIVOS', ascending=False)
@@ -87,10 +137,6 @@ def analizar_dispositivos_por_cliente(archivo_excel, archivo_salida="analisis_di
         clientes_un_dispositivo = len(df_analisis[df_analisis['CANTIDAD_DISPOSITIVOS'] == 1])
         clientes_mas_de_dos = len(df_analisis[df_analisis['CANTIDAD_DISPOSITIVOS'] > 2])
 
-        # Estadísticas de dispositivos
-        todos_dispositivos = [device for devices in clientes_dispositivos.values() for device in devices]
-        dispositivo_counts = pd.Series(todos_dispositivos).value_counts()
-
         print("=" * 70)
         print("📱 ANÁLISIS DE DISPOSITIVOS POR CLIENTE")
         print("=" * 70)
@@ -103,9 +149,9 @@ def analizar_dispositivos_por_cliente(archivo_excel, archivo_salida="analisis_di
         if clientes_multiples > 0:
             print("🏆 TOP 10 CLIENTES CON MÁS DISPOSITIVOS:")
             print("-" * 60)
-            for i, (_, row) in enumerate(df_analisis.head(10).iterrows(), 1):
+            for i, row in enumerate(df_analisis.head(10).itertuples(index=False), 1):
                 print(
-                    f"{i:2d}. {row['CUSTOMER_ID']:<15} {row['CANTIDAD_DISPOSITIVOS']:>2} dispositivos: {row['DISPOSITIVOS_UTILIZADOS']}")
+                    f"{i:2d}. {row.CUSTOMER_ID:<15} {row.CANTIDAD_DISPOSITIVOS:>2} dispositivos: {row.DISPOSITIVOS_UTILIZADOS}")
 
         print("=" * 70)
         print("📊 DISTRIBUCIÓN DE DISPOSITIVOS:")
@@ -129,9 +175,9 @@ def analizar_dispositivos_por_cliente(archivo_excel, archivo_salida="analisis_di
             print("   Todos los clientes usan un único dispositivo")
 
         # Crear archivo Excel con análisis detallado
-        with pd.ExcelWriter(archivo_salida, engine='openpyxl') as writer:
+        with excel_writer(archivo_salida) as writer:
             # Hoja principal con análisis completo
-            df_analisis.to_excel(writer, sheet_name='Análisis por Cliente', index=False)
+            write_sheet(writer, df_analisis, 'Análisis por Cliente')
 
             # Hoja con estadísticas resumidas
             stats_data = {
@@ -153,12 +199,11 @@ def analizar_dispositivos_por_cliente(archivo_excel, archivo_salida="analisis_di
                 ]
             }
             df_stats = pd.DataFrame(stats_data)
-            df_stats.to_excel(writer, sheet_name='Estadísticas', index=False)
+            write_sheet(writer, df_stats, 'Estadísticas')
 
-            # Hoja con top clientes con múltiples dispositivos
-            df_multiples = df_analisis[df_analisis['CANTIDAD_DISPOSITIVOS'] > 1].copy()
-            df_multiples = df_multiples.sort_values('CANTIDAD_DISPOSITIVOS', ascending=False)
-            df_multiples.to_excel(writer, sheet_name='Clientes Múltiples', index=False)
+            # Hoja con top clientes con múltiples dispositivos (df_analisis ya está ordenado)
+            df_multiples = df_analisis[df_analisis['CANTIDAD_DISPOSITIVOS'] > 1]
+            write_sheet(writer, df_multiples, 'Clientes Múltiples')
 
             # Hoja con distribución de dispositivos
             df_dispositivos = pd.DataFrame({
@@ -166,22 +211,7 @@ def analizar_dispositivos_por_cliente(archivo_excel, archivo_salida="analisis_di
                 'CLIENTES_QUE_USAN': dispositivo_counts.values,
                 'PORCENTAJE': (dispositivo_counts.values / total_clientes * 100).round(2)
             })
-            df_dispositivos.to_excel(writer, sheet_name='Dispositivos', index=False)
-
-            # Ajustar anchos de columnas
-            for sheet_name in writer.sheets:
-                worksheet = writer.sheets[sheet_name]
-                for column in worksheet.columns:
-                    max_length = 0
-                    column_letter = column[0].column_letter
-                    for cell in column:
-                        try:
-                            if len(str(cell.value)) > max_length:
-                                max_length = len(str(cell.value))
-                        except:
-                            pass
-                    adjusted_width = min(max_length + 2, 50)
-                    worksheet.column_dimensions[column_letter].width = adjusted_width
+            write_sheet(writer, df_dispositivos, 'Dispositivos')
 
         print(f"\n💾 Archivo Excel generado: {archivo_salida}")
         print("📋 Hojas incluidas:")
@@ -1,10 +1,10 @@
 import pandas as pd
-import matplotlib.pyplot as plt
+import numpy as np
 from openpyxl import Workbook
-from openpyxl.drawing.image import Image
 from openpyxl.utils.dataframe import dataframe_to_rows
 import os
-import io
+
+from analysis_common import excel_writer, load_dataset, write_sheet
 
 
 def analizar_generos_y_grafico(archivo_excel, archivo_salida="analisis_generos.xlsx"):
@@ -22,29 +22,22 @@ def analizar_generos_y_grafico(archivo_excel, archivo_salida="analisis_generos.x
             print(f"❌ Error: El archivo '{archivo_excel}' no existe.")
             return
 
-        # Leer la hoja "Dataset"
-        try:
-            df = pd.read_excel(archivo_excel, sheet_name='Dataset')
-        except:
-            # Si no encuentra por nombre, intentar por índice (segunda hoja)
-            try:
-                df = pd.read_excel(archivo_excel, sheet_name=1)
-                print("⚠️  Hoja 'Dataset' no encontrada, usando la segunda hoja del archivo")
-            except Exception as e:
-                print(f"❌ Error al leer el archivo Excel: {e}")
-                return
-
-        # Verificar si existe la columna GENRE
-        if 'GENRE' not in df.columns:
-            print("❌ Error: No se encontró la columna 'GENRE' en la hoja")
-            print(f"Columnas disponibles: {list(df.columns)}")
+        # Leer solo la columna GENRE de la hoja "Dataset"
+        df = load_dataset(archivo_excel, ['GENRE'])
+        if df is None:
             return
 
         # Obtener y limpiar los datos de género
-        generos = df['GENRE'].dropna().astype(str).str.strip()
-
-        # Contar frecuencias
-        conteo_generos = generos.value_counts()
+        generos = df['GENRE'].dropna().astype(str).str.strip().astype('category')
+
+        # Contar frecuencias sobre los códigos enteros de la categoría; los géneros se
+        # ordenan por primera aparición antes del orden estable, para que los empates
+        # queden como en value_counts
+        codigos = generos.cat.codes.to_numpy()
+        conteos = np.bincount(codigos, minlength=len(generos.cat.categories))
+        orden = pd.unique(codigos)
+        conteo_generos = pd.Series(conteos[orden], index=generos.cat.categories[orden]).sort_values(
+            ascending=False, kind='stable')
         total_registros = len(generos)
 
         print("=" * 60)
@@ -79,46 +72,22 @@ def analizar_generos_y_grafico(archivo_excel, archivo_salida="analisis_generos.x
             'PORCENTAJE (%)': (conteo_generos.values / total_registros * 100).round(2)
         })
 
-        # Crear gráfico de pastel
-        plt.figure(figsize=(12, 8))
-
-        # Si hay muchos géneros, agrupar los menos frecuentes en "Otros"
+        # Datos del gráfico de pastel: si hay muchos géneros, agrupar los menos frecuentes en "Otros"
         if len(conteo_generos) > 10:
             top_10 = conteo_generos.head(10)
             otros = conteo_generos[10:].sum()
-            datos_grafico = pd.concat([top_10, pd.Series([otros], index=['Otros'])])
             etiquetas = list(top_10.index) + ['Otros']
+            valores = list(top_10.values) + [otros]
         else:
-            datos_grafico = conteo_generos
-            etiquetas = conteo_generos.index
-
-        # Crear el gráfico de pastel
-        colors = plt.cm.Set3(range(len(datos_grafico)))
-        wedges, texts, autotexts = plt.pie(datos_grafico.values,
-                                           labels=etiquetas,
-                                           autopct='%1.1f%%',
-                                           startangle=90,
-                                           colors=colors,
-                                           textprops={'fontsize': 9})
-
-        plt.title('Distribución de Visualizaciones por Género\n', fontsize=16, fontweight='bold')
-        plt.axis('equal')  # Asegura que el pastel sea circular
-
-        # Mejorar la legibilidad
-        for autotext in autotexts:
-            autotext.set_color('white')
-            autotext.set_fontweight('bold')
-
-        # Guardar el gráfico en memoria
-        img_buffer = io.BytesIO()
-        plt.savefig(img_buffer, format='png', dpi=300, bbox_inches='tight')
-        img_buffer.seek(0)
-        plt.close()
+            etiquetas = list(conteo_generos.index)
+            valores = list(conteo_generos.values)
+
+        datos_grafico = pd.DataFrame({'GÉNERO': etiquetas, 'VISUALIZACIONES': valores})
 
         # Crear archivo Excel de salida
-        with pd.ExcelWriter(archivo_salida, engine='openpyxl') as writer:
+        with excel_writer(archivo_salida) as writer:
             # Guardar el reporte completo
-            reporte_df.to_excel(writer, sheet_name='Reporte Géneros', index=False)
+            worksheet = write_sheet(writer, reporte_df, 'Reporte Géneros')
 
             # Guardar estadísticas resumidas
             resumen_df = pd.DataFrame({
@@ -127,33 +96,26 @@ def analizar_generos_y_grafico(archivo_excel, archivo_salida="analisis_generos.x
                 'VALOR': [total_registros, len(conteo_generos), genero_mas_visto,
                           vistas_genero_mas_visto, f'{porcentaje_mas_visto:.2f}%']
             })
-            resumen_df.to_excel(writer, sheet_name='Resumen', index=False)
-
-            # Obtener el workbook y la hoja
-            workbook = writer.book
-            worksheet = workbook['Reporte Géneros']
-
-            # Insertar el gráfico en el Excel
-            img = Image(img_buffer)
-            img.width = 600
-            img.height = 400
+            write_sheet(writer, resumen_df, 'Resumen')
+
+            # Guardar los datos que alimentan el gráfico
+            write_sheet(writer, datos_grafico, 'Datos Gráfico')
+
+            # Crear un gráfico de pastel nativo de Excel (lo dibuja el visor, sin imagen)
+            filas_grafico = len(datos_grafico)
+            grafico = writer.book.add_chart({'type': 'pie'})
+            grafico.add_series({
+                'name': 'VISUALIZACIONES',
+                'categories': ['Datos Gráfico', 1, 0, filas_grafico, 0],
+                'values': ['Datos Gráfico', 1, 1, filas_grafico, 1],
+                'data_labels': {'percentage': True},
+            })
+            grafico.set_title({'name': 'Distribución de Visualizaciones por Género'})
+            grafico.set_size({'width': 600, 'height': 400})
 
-            # Agregar imagen después de los datos
+            # Agregar el gráfico después de los datos
             max_row = len(reporte_df) + 2
-            worksheet.add_image(img, f'E{max_row}')
-
-            # Ajustar el ancho de las columnas
-            for column in worksheet.columns:
-                max_length = 0
-                column_letter = column[0].column_letter
-                for cell in column:
-                    try:
-                        if len(str(cell.value)) > max_length:
-                            max_length = len(str(cell.value))
-                    except:
-                        pass
-                adjusted_width = min(max_length + 2, 50)
-                worksheet.column_dimensions[column_letter].width = adjusted_width
+            worksheet.insert_chart(f'E{max_row}', grafico)
 
         print(f"💾 Archivo Excel generado: {archivo_salida}")
         print("📊 Gráfico de pastel incluido en el archivo")
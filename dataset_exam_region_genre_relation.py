@@ -1,11 +1,10 @@
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 from openpyxl import Workbook
 from openpyxl.utils.dataframe import dataframe_to_rows
-from openpyxl.drawing.image import Image
 import os
-import io
+
+from analysis_common import excel_writer, load_cleaned_dataset, write_sheet
 
 
 def analizar_relacion_region_genero(archivo_excel, archivo_salida="analisis_region_genero.xlsx"):
@@ -23,38 +22,20 @@ def analizar_relacion_region_genero(archivo_excel, archivo_salida="analisis_regi
             print(f"❌ Error: El archivo '{archivo_excel}' no existe.")
             return None
 
-        # Leer la hoja "Dataset"
-        try:
-            df = pd.read_excel(archivo_excel, sheet_name='Dataset')
-        except:
-            # Si no encuentra por nombre, intentar por índice (segunda hoja)
-            try:
-                df = pd.read_excel(archivo_excel, sheet_name=1)
-                print("⚠️  Hoja 'Dataset' no encontrada, usando la segunda hoja del archivo")
-            except Exception as e:
-                print(f"❌ Error al leer el archivo Excel: {e}")
-                return None
-
-        # Verificar si existen las columnas necesarias
-        columnas_requeridas = ['REGION', 'GENRE']
-        for columna in columnas_requeridas:
-            if columna not in df.columns:
-                print(f"❌ Error: No se encontró la columna '{columna}' en la hoja")
-                print(f"Columnas disponibles: {list(df.columns)}")
-                return None
-
-        # Limpiar y preparar los datos
-        df_clean = df[['REGION', 'GENRE']].copy()
-        df_clean['REGION'] = df_clean['REGION'].astype(str).str.strip()
-        df_clean['GENRE'] = df_clean['GENRE'].astype(str).str.strip()
-        df_clean = df_clean.dropna()
-        df_clean = df_clean[(df_clean['REGION'] != '') & (df_clean['REGION'] != 'nan')]
-        df_clean = df_clean[(df_clean['GENRE'] != '') & (df_clean['GENRE'] != 'nan')]
-
-        # Calcular estadísticas generales
+        # Leer y limpiar las columnas necesarias (sin nulos ni vacíos, como categorías)
+        df_clean = load_cleaned_dataset(archivo_excel, ['REGION', 'GENRE'], categoricas=('REGION', 'GENRE'))
+        if df_clean is None:
+            return None
+
+        # Crear tabla de contingencia (frecuencias cruzadas) con un solo groupby
+        tabla_contingencia = df_clean.groupby(['REGION', 'GENRE'], observed=True).size().unstack(fill_value=0)
+        tabla_contingencia.index = tabla_contingencia.index.astype(str)
+        tabla_contingencia.columns = tabla_contingencia.columns.astype(str)
+
+        # Calcular estadísticas generales (las regiones y géneros únicos son los ejes de la tabla)
         total_registros = len(df_clean)
-        regiones_unicas = df_clean['REGION'].nunique()
-        generos_unicos = df_clean['GENRE'].nunique()
+        regiones_unicas = len(tabla_contingencia.index)
+        generos_unicos = len(tabla_contingencia.columns)
 
         print("=" * 70)
         print("🌍 ANÁLISIS DE RELACIÓN REGIÓN-GÉNERO")
@@ -64,58 +45,41 @@ def analizar_relacion_region_genero(archivo_excel, archivo_salida="analisis_regi
         print(f"🎭 Géneros únicos: {generos_unicos}")
         print("=" * 70)
 
-        # Crear tabla de contingencia (frecuencias cruzadas)
-        tabla_contingencia = pd.crosstab(df_clean['REGION'], df_clean['GENRE'])
+        # Totales por región y por género, como arreglos de NumPy
+        regiones = tabla_contingencia.index.to_numpy()
+        generos = tabla_contingencia.columns.to_numpy()
+        valores = tabla_contingencia.to_numpy()
+        totales_region = valores.sum(axis=1)
 
         # Calcular porcentajes por región
-        tabla_porcentajes = tabla_contingencia.div(tabla_contingencia.sum(axis=1), axis=0) * 100
+        tabla_porcentajes = tabla_contingencia.div(totales_region, axis=0) * 100
         tabla_porcentajes = tabla_porcentajes.round(2)
 
-        # Encontrar top géneros por región
-        top_generos_por_region = []
-
-        for region in tabla_contingencia.index:
-            generos_region = tabla_contingencia.loc[region]
-            total_region = generos_region.sum()
-
-            # Top 3 géneros
-            top3 = generos_region.nlargest(3)
-
-            for i, (genero, count) in enumerate(top3.items(), 1):
-                porcentaje = (count / total_region) * 100
-                top_generos_por_region.append({
-                    'REGION': region,
-                    'RANKING': i,
-                    'GÉNERO': genero,
-                    'VISUALIZACIONES': count,
-                    'PORCENTAJE': round(porcentaje, 2),
-                    'TOTAL_REGION': total_region
-                })
-
-        df_top = pd.DataFrame(top_generos_por_region)
-
-        # Estadísticas por región
-        stats_region = pd.DataFrame({
-            'REGION': tabla_contingencia.index,
-            'TOTAL_VISUALIZACIONES': tabla_contingencia.sum(axis=1),
-            'GÉNEROS_ÚNICOS': (tabla_contingencia > 0).sum(axis=1),
-            'GÉNERO_MÁS_POPULAR': tabla_contingencia.idxmax(axis=1),
-            'VISTAS_GÉNERO_TOP': tabla_contingencia.max(axis=1),
-            'PORCENTAJE_GÉNERO_TOP': [round((max(row) / sum(row)) * 100, 2) for _, row in tabla_contingencia.iterrows()]
+        # Encontrar top 3 géneros por región, para todas las regiones a la vez
+        # (orden estable: a igual cantidad gana el primer género, como en nlargest)
+        top3 = np.argsort(-valores, axis=1, kind='stable')[:, :3]
+        vistas_top3 = np.take_along_axis(valores, top3, axis=1)
+        n_top = top3.shape[1]
+
+        df_top = pd.DataFrame({
+            'REGION': np.repeat(regiones, n_top),
+            'RANKING': np.tile(np.arange(1, n_top + 1), len(valores)),
+            'GÉNERO': generos[top3].ravel(),
+            'VISUALIZACIONES': vistas_top3.ravel(),
+            'PORCENTAJE': (vistas_top3 / totales_region[:, np.newaxis] * 100).round(2).ravel(),
+            'TOTAL_REGION': np.repeat(totales_region, n_top)
         })
 
-        # Calcular diversidad de consumo (índice de Herfindahl-Hirschman)
-        def calcular_hhi(porcentajes):
-            return sum([p ** 2 for p in porcentajes])
-
-        stats_region['ÍNDICE_DIVERSIDAD'] = [
-            calcular_hhi(tabla_porcentajes.loc[region].values) for region in stats_region['REGION']
-        ]
+        # Calcular diversidad de consumo (índice de Herfindahl-Hirschman): suma de
+        # los cuadrados de los porcentajes de cada región, en una sola operación
+        indice_diversidad = np.square(tabla_porcentajes.to_numpy()).sum(axis=1)
 
-        # Clasificar diversidad
-        stats_region['NIVEL_DIVERSIDAD'] = pd.cut(stats_region['ÍNDICE_DIVERSIDAD'],
-                                                  bins=[0, 1500, 2500, 10000],
-                                                  labels=['Alta Diversidad', 'Media Diversidad', 'Baja Diversidad'])
+        # Calcular una sola vez las regiones y el género destacados (se usan en consola y en el resumen)
+        region_mayor_consumo = regiones[totales_region.argmax()]
+        region_menor_consumo = regiones[totales_region.argmin()]
+        region_mas_diversa = regiones[indice_diversidad.argmin()]
+        region_menos_diversa = regiones[indice_diversidad.argmax()]
+        genero_top_global = generos[valores.sum(axis=0).argmax()]
 
         # Mostrar resultados en consola
         print("🏆 TOP 1 GÉNERO POR REGIÓN:")
@@ -128,25 +92,42 @@ def analizar_relacion_region_genero(archivo_excel, archivo_salida="analisis_regi
         print("=" * 70)
         print("📈 ESTADÍSTICAS GENERALES:")
         print("-" * 40)
-        print(f"Región con mayor consumo: {stats_region.loc[stats_region['TOTAL_VISUALIZACIONES'].idxmax(), 'REGION']}")
-        print(f"Región con menor consumo: {stats_region.loc[stats_region['TOTAL_VISUALIZACIONES'].idxmin(), 'REGION']}")
-        print(f"Género más popular global: {tabla_contingencia.sum().idxmax()}")
-        print(f"Región más diversa: {stats_region.loc[stats_region['ÍNDICE_DIVERSIDAD'].idxmin(), 'REGION']}")
-        print(f"Región menos diversa: {stats_region.loc[stats_region['ÍNDICE_DIVERSIDAD'].idxmax(), 'REGION']}")
+        print(f"Región con mayor consumo: {region_mayor_consumo}")
+        print(f"Región con menor consumo: {region_menor_consumo}")
+        print(f"Género más popular global: {genero_top_global}")
+        print(f"Región más diversa: {region_mas_diversa}")
+        print(f"Región menos diversa: {region_menos_diversa}")
+
+        # Estadísticas por región
+        # (el género top de cada región es el primero de su top 3, ya calculado)
+        stats_region = pd.DataFrame({
+            'REGION': regiones,
+            'TOTAL_VISUALIZACIONES': totales_region,
+            'GÉNEROS_ÚNICOS': (valores > 0).sum(axis=1),
+            'GÉNERO_MÁS_POPULAR': generos[top3[:, 0]],
+            'VISTAS_GÉNERO_TOP': vistas_top3[:, 0],
+            'PORCENTAJE_GÉNERO_TOP': (vistas_top3[:, 0] / totales_region * 100).round(2),
+            'ÍNDICE_DIVERSIDAD': indice_diversidad
+        }, index=tabla_contingencia.index)
+
+        # Clasificar diversidad
+        stats_region['NIVEL_DIVERSIDAD'] = pd.cut(stats_region['ÍNDICE_DIVERSIDAD'],
+                                                  bins=[0, 1500, 2500, 10000],
+                                                  labels=['Alta Diversidad', 'Media Diversidad', 'Baja Diversidad'])
 
         # Crear archivo Excel con análisis completo
-        with pd.ExcelWriter(archivo_salida, engine='openpyxl') as writer:
+        with excel_writer(archivo_salida) as writer:
             # Hoja 1: Tabla de contingencia (frecuencias absolutas)
-            tabla_contingencia.to_excel(writer, sheet_name='Frecuencias Absolutas')
+            write_sheet(writer, tabla_contingencia, 'Frecuencias Absolutas', ancho_maximo=35, index=True)
 
             # Hoja 2: Tabla de porcentajes
-            tabla_porcentajes.to_excel(writer, sheet_name='Porcentajes por Región')
+            write_sheet(writer, tabla_porcentajes, 'Porcentajes por Región', ancho_maximo=35, index=True)
 
             # Hoja 3: Top géneros por región
-            df_top.to_excel(writer, sheet_name='Top Géneros por Región', index=False)
+            write_sheet(writer, df_top, 'Top Géneros por Región', ancho_maximo=35)
 
             # Hoja 4: Estadísticas por región
-            stats_region.to_excel(writer, sheet_name='Estadísticas Regiones', index=False)
+            write_sheet(writer, stats_region, 'Estadísticas Regiones', ancho_maximo=35)
 
             # Hoja 5: Resumen ejecutivo
             resumen_data = {
@@ -167,52 +148,18 @@ def analizar_relacion_region_genero(archivo_excel, archivo_salida="analisis_regi
                     total_registros,
                     regiones_unicas,
                     generos_unicos,
-                    stats_region.loc[stats_region['TOTAL_VISUALIZACIONES'].idxmax(), 'REGION'],
-                    stats_region.loc[stats_region['TOTAL_VISUALIZACIONES'].idxmin(), 'REGION'],
-                    tabla_contingencia.sum().idxmax(),
-                    stats_region.loc[stats_region['ÍNDICE_DIVERSIDAD'].idxmin(), 'REGION'],
-                    stats_region.loc[stats_region['ÍNDICE_DIVERSIDAD'].idxmax(), 'REGION'],
+                    region_mayor_consumo,
+                    region_menor_consumo,
+                    genero_top_global,
+                    region_mas_diversa,
+                    region_menos_diversa,
                     f"{stats_region['PORCENTAJE_GÉNERO_TOP'].mean():.1f}%",
                     len(stats_region[stats_region['NIVEL_DIVERSIDAD'] == 'Alta Diversidad']),
                     len(stats_region[stats_region['NIVEL_DIVERSIDAD'] == 'Baja Diversidad'])
                 ]
             }
             df_resumen = pd.DataFrame(resumen_data)
-            df_resumen.to_excel(writer, sheet_name='Resumen Ejecutivo', index=False)
-
-            # Crear y guardar gráficos
-            if len(stats_region) <= 15:  # Solo si hay pocas regiones
-                # Gráfico de heatmap
-                plt.figure(figsize=(12, 8))
-                import seaborn as sns
-
-                # Normalizar para mejor visualización
-                tabla_normalizada = tabla_contingencia.div(tabla_contingencia.sum(axis=1), axis=0)
-
-                sns.heatmap(tabla_normalizada, cmap='YlOrRd', annot=False, fmt='.2f')
-                plt.title('Distribución de Géneros por Región (Normalizado)')
-                plt.xticks(rotation=45, ha='right')
-                plt.tight_layout()
-
-                img_heatmap = io.BytesIO()
-                plt.savefig(img_heatmap, format='png', dpi=300, bbox_inches='tight')
-                img_heatmap.seek(0)
-                plt.close()
-
-            # Ajustar anchos de columnas
-            for sheet_name in writer.sheets:
-                worksheet = writer.sheets[sheet_name]
-                for column in worksheet.columns:
-                    max_length = 0
-                    column_letter = column[0].column_letter
-                    for cell in column:
-                        try:
-                            if len(str(cell.value)) > max_length:
-                                max_length = len(str(cell.value))
-                        except:
-                            pass
-                    adjusted_width = min(max_length + 2, 35)
-                    worksheet.column_dimensions[column_letter].width = adjusted_width
+            write_sheet(writer, df_resumen, 'Resumen Ejecutivo', ancho_maximo=35)
 
         print(f"\n💾 Archivo Excel generado: {archivo_salida}")
         print("📋 Hojas incluidas:")
@@ -1,13 +1,82 @@
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib.figure import Figure
 from openpyxl import Workbook
 from openpyxl.utils.dataframe import dataframe_to_rows
-from openpyxl.drawing.image import Image
 import os
 import io
+from concurrent.futures import ThreadPoolExecutor
 from scipy import stats
 
+from analysis_common import excel_writer, insert_image, load_cleaned_dataset, top_n, write_sheet
+
+
+def _generar_graficos(analisis_completo, dist_frecuencia, dist_screentime, segmentos):
+    """
+    Genera la figura de 4 gráficos del análisis de recurrencia como imagen PNG
+
+    Dibuja sobre una Figure propia con el backend Agg, en lugar de la figura
+    actual de pyplot, para poder ejecutarse en un hilo aparte (los gráficos de
+    pandas reciben el eje con ax=, aunque pandas importe pyplot internamente).
+
+    Args:
+        analisis_completo (pd.DataFrame): Análisis por cliente
+        dist_frecuencia (pd.Series): Clientes por categoría de frecuencia
+        dist_screentime (pd.Series): Clientes por categoría de screentime
+        segmentos (pd.DataFrame): Tabla de segmentación frecuencia vs screentime
+
+    Returns:
+        io.BytesIO: Buffer con la imagen PNG
+    """
+
+    fig = Figure(figsize=(15, 12))
+    ((ax1, ax2), (ax3, ax4)) = fig.subplots(2, 2)
+
+    # Gráfico 1: Distribución de frecuencia
+    dist_frecuencia.plot(kind='bar', ax=ax1, color='skyblue', edgecolor='black')
+    ax1.set_title('Distribución de Clientes por Frecuencia de Visualizaciones')
+    ax1.set_xlabel('Categoría de Frecuencia')
+    ax1.set_ylabel('Número de Clientes')
+    ax1.tick_params(axis='x', rotation=45)
+
+    # Gráfico 2: Distribución de screentime
+    dist_screentime.plot(kind='bar', ax=ax2, color='lightcoral', edgecolor='black')
+    ax2.set_title('Distribución de Clientes por Screentime Total')
+    ax2.set_xlabel('Categoría de Screentime')
+    ax2.set_ylabel('Número de Clientes')
+    ax2.tick_params(axis='x', rotation=45)
+
+    # Gráfico 3: Densidad frecuencia vs screentime (hexágonos en escala logarítmica,
+    # en lugar de un punto por cliente; los valores <= 0 no tienen logaritmo)
+    frecuencia = analisis_completo['FRECUENCIA_VISUALIZACIONES'].to_numpy()
+    screentime = analisis_completo['SCREENTIME_TOTAL'].to_numpy()
+    positivos = (frecuencia > 0) & (screentime > 0)
+    hb = ax3.hexbin(frecuencia[positivos], screentime[positivos], xscale='log', yscale='log',
+                    gridsize=50, cmap='Greens', mincnt=1)
+    ax3.set_title('Relación entre Frecuencia y Screentime Total')
+    ax3.set_xlabel('Frecuencia de Visualizaciones')
+    ax3.set_ylabel('Screentime Total (minutos)')
+    fig.colorbar(hb, ax=ax3)
+
+    # Gráfico 4: Heatmap de segmentación
+    im = ax4.imshow(segmentos.values, cmap='YlOrRd', aspect='auto')
+    ax4.set_title('Segmentación: Frecuencia vs Screentime')
+    ax4.set_xticks(range(len(segmentos.columns)))
+    ax4.set_yticks(range(len(segmentos.index)))
+    ax4.set_xticklabels(segmentos.columns, rotation=45)
+    ax4.set_yticklabels(segmentos.index)
+    fig.colorbar(im, ax=ax4)
+
+    fig.tight_layout()
+
+    # Guardar gráficos
+    img_buffer = io.BytesIO()
+    fig.savefig(img_buffer, format='png', dpi=100)
+    img_buffer.seek(0)
+    return img_buffer
+
 
 def analizar_recurrencia_consumo(archivo_excel, archivo_salida="analisis_recurrencia.xlsx"):
     """
@@ -24,36 +93,15 @@ def analizar_recurrencia_consumo(archivo_excel, archivo_salida="analisis_recurre
             print(f"❌ Error: El archivo '{archivo_excel}' no existe.")
             return None
 
-        # Leer la hoja "Dataset"
-        try:
-            df = pd.read_excel(archivo_excel, sheet_name='Dataset')
-        except:
-            # Si no encuentra por nombre, intentar por índice (segunda hoja)
-            try:
-                df = pd.read_excel(archivo_excel, sheet_name=1)
-                print("⚠️  Hoja 'Dataset' no encontrada, usando la segunda hoja del archivo")
-            except Exception as e:
-                print(f"❌ Error al leer el archivo Excel: {e}")
-                return None
-
-        # Verificar si existen las columnas necesarias
-        columnas_requeridas = ['CUSTOMER_ID', 'SCREENTIME']
-        for columna in columnas_requeridas:
-            if columna not in df.columns:
-                print(f"❌ Error: No se encontró la columna '{columna}' en la hoja")
-                print(f"Columnas disponibles: {list(df.columns)}")
-                return None
-
-        # Limpiar y preparar los datos
-        df_clean = df[['CUSTOMER_ID', 'SCREENTIME']].copy()
-        df_clean['CUSTOMER_ID'] = df_clean['CUSTOMER_ID'].astype(str).str.strip()
-
-        # Convertir SCREENTIME a numérico, manejando posibles errores
-        df_clean['SCREENTIME'] = pd.to_numeric(df_clean['SCREENTIME'], errors='coerce')
-        df_clean = df_clean.dropna()
+        # Leer y limpiar las columnas necesarias (SCREENTIME numérico, CUSTOMER_ID como categoría)
+        df_clean = load_cleaned_dataset(archivo_excel, ['CUSTOMER_ID', 'SCREENTIME'],
+                                        categoricas=('CUSTOMER_ID',), numericas=('SCREENTIME',),
+                                        descartar_vacios=False)
+        if df_clean is None:
+            return None
 
         total_registros = len(df_clean)
-        clientes_unicos = df_clean['CUSTOMER_ID'].nunique()
+        clientes_unicos = len(df_clean['CUSTOMER_ID'].cat.categories)
 
         print("=" * 80)
         print("📊 ANÁLISIS DE RECURRENCIA DE CONSUMO POR CLIENTE")
@@ -63,19 +111,20 @@ def analizar_recurrencia_consumo(archivo_excel, archivo_salida="analisis_recurre
         print(f"📈 Ratio promedio de visualizaciones por cliente: {total_registros / clientes_unicos:.2f}")
         print("=" * 80)
 
-        # Análisis de frecuencia de visualizaciones
-        frecuencia_clientes = df_clean['CUSTOMER_ID'].value_counts().reset_index()
-        frecuencia_clientes.columns = ['CUSTOMER_ID', 'FRECUENCIA_VISUALIZACIONES']
-
-        # Análisis de screentime acumulado
-        screentime_clientes = df_clean.groupby('CUSTOMER_ID')['SCREENTIME'].agg([
-            'sum', 'mean', 'std', 'count'
-        ]).reset_index()
-        screentime_clientes.columns = ['CUSTOMER_ID', 'SCREENTIME_TOTAL', 'SCREENTIME_PROMEDIO',
-                                       'SCREENTIME_DESVEST', 'FRECUENCIA']
-
-        # Combinar ambos análisis
-        analisis_completo = frecuencia_clientes.merge(screentime_clientes, on='CUSTOMER_ID', how='inner')
+        # Análisis de frecuencia de visualizaciones y screentime acumulado en un solo groupby
+        analisis_completo = df_clean.groupby('CUSTOMER_ID', sort=False, observed=True)['SCREENTIME'].agg(
+            FRECUENCIA_VISUALIZACIONES='size',
+            SCREENTIME_TOTAL='sum',
+            SCREENTIME_PROMEDIO='mean',
+            SCREENTIME_DESVEST='std'
+        )
+        # Sin nulos tras la limpieza, el conteo de SCREENTIME es igual a la frecuencia
+        analisis_completo['FRECUENCIA'] = analisis_completo['FRECUENCIA_VISUALIZACIONES']
+        analisis_completo.index = analisis_completo.index.astype(str)
+
+        # Ordenar por frecuencia (descendente; a igual frecuencia, por orden de aparición)
+        analisis_completo = analisis_completo.sort_values('FRECUENCIA_VISUALIZACIONES', ascending=False,
+                                                          kind='stable').reset_index()
 
         # Calcular métricas adicionales
         analisis_completo['SCREENTIME_POR_VISUALIZACION'] = analisis_completo['SCREENTIME_TOTAL'] / analisis_completo[
@@ -86,19 +135,22 @@ def analizar_recurrencia_consumo(archivo_excel, archivo_salida="analisis_recurre
         labels_frecuencia = ['Ocasional (1)', 'Frecuente (2-3)', 'Muy Frecuente (4-10)',
                              'Super Usuario (11-50)', 'Power User (50+)']
 
-        analisis_completo['CATEGORIA_FRECUENCIA'] = pd.cut(analisis_completo['FRECUENCIA_VISUALIZACIONES'],
-                                                           bins=bins_frecuencia,
-                                                           labels=labels_frecuencia,
-                                                           right=False)
+        # Intervalos [a, b): el índice del intervalo sale de una búsqueda binaria sobre los límites
+        frecuencias = analisis_completo['FRECUENCIA_VISUALIZACIONES'].to_numpy()
+        codigos_frecuencia = np.searchsorted(bins_frecuencia, frecuencias, side='right') - 1
+        analisis_completo['CATEGORIA_FRECUENCIA'] = pd.Categorical.from_codes(
+            codigos_frecuencia, categories=labels_frecuencia, ordered=True)
 
         # Clasificar clientes por screentime total
-        percentiles = analisis_completo['SCREENTIME_TOTAL'].quantile([0.33, 0.66])
-        bins_screentime = [0, percentiles.iloc[0], percentiles.iloc[1], float('inf')]
+        screentime_total = analisis_completo['SCREENTIME_TOTAL'].to_numpy()
+        percentiles = np.quantile(screentime_total, [0.33, 0.66])
         labels_screentime = ['Bajo Consumo', 'Medio Consumo', 'Alto Consumo']
 
-        analisis_completo['CATEGORIA_SCREENTIME'] = pd.cut(analisis_completo['SCREENTIME_TOTAL'],
-                                                           bins=bins_screentime,
-                                                           labels=labels_screentime)
+        # Intervalos (0, p33], (p33, p66], (p66, inf); los valores <= 0 quedan sin categoría
+        codigos_screentime = np.searchsorted(percentiles, screentime_total, side='left')
+        codigos_screentime[screentime_total <= 0] = -1
+        analisis_completo['CATEGORIA_SCREENTIME'] = pd.Categorical.from_codes(
+            codigos_screentime, categories=labels_screentime, ordered=True)
 
         # Estadísticas generales
         stats_generales = {
@@ -154,97 +206,35 @@ def analizar_recurrencia_consumo(archivo_excel, archivo_salida="analisis_recurre
 
         print(f"\n💎 Clientes valiosos (alta frecuencia + alto screentime): {len(clientes_valiosos)}")
 
-        # Crear gráficos
-        fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2, figsize=(15, 12))
-
-        # Gráfico 1: Distribución de frecuencia
-        dist_frecuencia.plot(kind='bar', ax=ax1, color='skyblue', edgecolor='black')
-        ax1.set_title('Distribución de Clientes por Frecuencia de Visualizaciones')
-        ax1.set_xlabel('Categoría de Frecuencia')
-        ax1.set_ylabel('Número de Clientes')
-        ax1.tick_params(axis='x', rotation=45)
-
-        # Gráfico 2: Distribución de screentime
-        dist_screentime.plot(kind='bar', ax=ax2, color='lightcoral', edgecolor='black')
-        ax2.set_title('Distribución de Clientes por Screentime Total')
-        ax2.set_xlabel('Categoría de Screentime')
-        ax2.set_ylabel('Número de Clientes')
-        ax2.tick_params(axis='x', rotation=45)
-
-        # Gráfico 3: Scatter plot frecuencia vs screentime
-        ax3.scatter(analisis_completo['FRECUENCIA_VISUALIZACIONES'],
-                    analisis_completo['SCREENTIME_TOTAL'],
-                    alpha=0.6, color='green', s=30)
-        ax3.set_title('Relación entre Frecuencia y Screentime Total')
-        ax3.set_xlabel('Frecuencia de Visualizaciones')
-        ax3.set_ylabel('Screentime Total (minutos)')
-        ax3.set_xscale('log')
-        ax3.set_yscale('log')
-
-        # Gráfico 4: Heatmap de segmentación
-        im = ax4.imshow(segmentos.values, cmap='YlOrRd', aspect='auto')
-        ax4.set_title('Segmentación: Frecuencia vs Screentime')
-        ax4.set_xticks(range(len(segmentos.columns)))
-        ax4.set_yticks(range(len(segmentos.index)))
-        ax4.set_xticklabels(segmentos.columns, rotation=45)
-        ax4.set_yticklabels(segmentos.index)
-        plt.colorbar(im, ax=ax4)
-
-        plt.tight_layout()
-
-        # Guardar gráficos
-        img_buffer = io.BytesIO()
-        plt.savefig(img_buffer, format='png', dpi=300, bbox_inches='tight')
-        img_buffer.seek(0)
-        plt.close()
-
-        # Crear archivo Excel con análisis completo
-        with pd.ExcelWriter(archivo_salida, engine='openpyxl') as writer:
+        # Crear archivo Excel con análisis completo, mientras los gráficos se generan en otro hilo
+        with ThreadPoolExecutor(max_workers=1) as executor, excel_writer(archivo_salida) as writer:
+            futuro_graficos = executor.submit(_generar_graficos, analisis_completo, dist_frecuencia,
+                                              dist_screentime, segmentos)
+
             # Hoja 1: Análisis completo por cliente
-            analisis_completo.to_excel(writer, sheet_name='Análisis por Cliente', index=False)
+            write_sheet(writer, analisis_completo, 'Análisis por Cliente', ancho_maximo=35)
 
-            # Hoja 2: Estadísticas generales
+            # Hoja 2: Estadísticas generales (los gráficos se agregan al final)
             df_stats = pd.DataFrame(list(stats_generales.items()), columns=['Métrica', 'Valor'])
-            df_stats.to_excel(writer, sheet_name='Estadísticas', index=False)
+            worksheet_stats = write_sheet(writer, df_stats, 'Estadísticas', ancho_maximo=35)
 
             # Hoja 3: Segmentación
-            segmentos.reset_index().to_excel(writer, sheet_name='Segmentación', index=False)
+            write_sheet(writer, segmentos, 'Segmentación', ancho_maximo=35, index=True)
 
             # Hoja 4: Clientes valiosos
-            clientes_valiosos.to_excel(writer, sheet_name='Clientes Valiosos', index=False)
+            write_sheet(writer, clientes_valiosos, 'Clientes Valiosos', ancho_maximo=35)
 
             # Hoja 5: Top clientes por diferentes métricas
-            top_frecuencia = analisis_completo.nlargest(20, 'FRECUENCIA_VISUALIZACIONES')
-            top_screentime = analisis_completo.nlargest(20, 'SCREENTIME_TOTAL')
-            top_promedio = analisis_completo.nlargest(20, 'SCREENTIME_PROMEDIO')
+            top_frecuencia = top_n(analisis_completo, 'FRECUENCIA_VISUALIZACIONES')
+            top_screentime = top_n(analisis_completo, 'SCREENTIME_TOTAL')
+            top_promedio = top_n(analisis_completo, 'SCREENTIME_PROMEDIO')
 
-            top_frecuencia.to_excel(writer, sheet_name='Top Frecuencia', index=False)
-            top_screentime.to_excel(writer, sheet_name='Top Screentime', index=False)
-            top_promedio.to_excel(writer, sheet_name='Top Promedio', index=False)
+            write_sheet(writer, top_frecuencia, 'Top Frecuencia', ancho_maximo=35)
+            write_sheet(writer, top_screentime, 'Top Screentime', ancho_maximo=35)
+            write_sheet(writer, top_promedio, 'Top Promedio', ancho_maximo=35)
 
             # Agregar gráficos
-            workbook = writer.book
-            worksheet = workbook['Estadísticas']
-
-            img = Image(img_buffer)
-            img.width = 800
-            img.height = 600
-            worksheet.add_image(img, 'D2')
-
-            # Ajustar anchos de columnas
-            for sheet_name in writer.sheets:
-                worksheet = writer.sheets[sheet_name]
-                for column in worksheet.columns:
-                    max_length = 0
-                    column_letter = column[0].column_letter
-                    for cell in column:
-                        try:
-                            if len(str(cell.value)) > max_length:
-                                max_length = len(str(cell.value))
-                        except:
-                            pass
-                    adjusted_width = min(max_length + 2, 35)
-                    worksheet.column_dimensions[column_letter].width = adjusted_width
+            insert_image(worksheet_stats, 'D2', futuro_graficos.result(), 800, 600)
 
         print(f"\n💾 Archivo Excel generado: {archivo_salida}")
         print("📋 Hojas incluidas:")
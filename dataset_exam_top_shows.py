@@ -1,13 +1,128 @@
 import pandas as pd
-import matplotlib.pyplot as plt
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib import cm
+from matplotlib.artist import setp
+from matplotlib.figure import Figure
 from openpyxl import Workbook
 from openpyxl.utils.dataframe import dataframe_to_rows
-from openpyxl.drawing.image import Image
 import os
 import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
+from analysis_common import excel_writer, insert_image, load_cleaned_dataset, write_sheet
 
-def analizar_shows_por_visualizaciones(archivo_excel, archivo_salida="analisis_shows_tv.xlsx", top_n=20):
+
+def _contar_pares(codigos_titulo, codigos_genero, n_generos):
+    """
+    Cuenta los registros de cada par (título, género) a partir de sus códigos enteros
+
+    Cada par se codifica como un solo entero; si la tabla completa de pares es
+    chica respecto de la cantidad de registros se cuenta con np.bincount, y si
+    no, ordenando las claves con np.unique. En ambos casos los pares quedan en
+    orden de (título, género), como en un groupby.
+
+    Args:
+        codigos_titulo (np.ndarray): Código entero del título de cada registro
+        codigos_genero (np.ndarray): Código entero del género de cada registro
+        n_generos (int): Cantidad de géneros distintos
+
+    Returns:
+        tuple: (código de título, código de género y cantidad de registros de cada par observado)
+    """
+
+    claves = codigos_titulo.astype(np.int64) * n_generos + codigos_genero
+    if len(claves) and (claves.max() + 1) <= 4 * len(claves):
+        conteos = np.bincount(claves)
+        claves_unicas = np.flatnonzero(conteos)
+        conteos = conteos[claves_unicas]
+    else:
+        claves_unicas, conteos = np.unique(claves, return_counts=True)
+
+    codigos_titulo_par, codigos_genero_par = np.divmod(claves_unicas, n_generos)
+    return codigos_titulo_par, codigos_genero_par, conteos
+
+
+# Figure del gráfico de pastel, reutilizada entre llamadas en lugar de crear una nueva
+# cada vez; el lock evita que dos hilos dibujen sobre ella al mismo tiempo
+_FIGURA = None
+_FIGURA_LOCK = threading.Lock()
+
+
+def _obtener_figura():
+    """
+    Devuelve la Figure compartida del gráfico de pastel, vacía y lista para dibujar
+
+    Debe llamarse con _FIGURA_LOCK tomado.
+
+    Returns:
+        Figure: Figure de 14x10 pulgadas sin ejes
+    """
+
+    global _FIGURA
+    if _FIGURA is None:
+        _FIGURA = Figure(figsize=(14, 10))
+    else:
+        _FIGURA.clear()
+    return _FIGURA
+
+
+def _generar_grafico(datos_grafico, etiquetas, legend_labels, top_n):
+    """
+    Genera el gráfico de pastel de visualizaciones por show como imagen PNG
+
+    Usa una Figure propia (sin el estado global de pyplot) para poder
+    ejecutarse en un hilo aparte; la Figure se reutiliza entre llamadas.
+
+    Args:
+        datos_grafico (pd.DataFrame): Shows del gráfico (top + "Otros") con sus visualizaciones
+        etiquetas (list): Etiqueta de cada porción
+        legend_labels (list): Texto de la leyenda para cada porción
+        top_n (int): Número de shows top incluidos en el gráfico
+
+    Returns:
+        io.BytesIO: Buffer con la imagen PNG
+    """
+
+    with _FIGURA_LOCK:
+        fig = _obtener_figura()
+        ax = fig.subplots()
+
+        colors = cm.tab20c(range(len(datos_grafico)))
+        wedges, texts, autotexts = ax.pie(
+            datos_grafico['VISUALIZACIONES'],
+            labels=etiquetas,
+            autopct='%1.1f%%',
+            startangle=90,
+            colors=colors,
+            pctdistance=0.85,
+            textprops={'fontsize': 8},
+            wedgeprops={'linewidth': 0}
+        )
+
+        # Mejorar la legibilidad (una sola llamada para todos los porcentajes)
+        setp(autotexts, color='white', fontweight='bold', fontsize=7)
+
+        ax.set_title(f'Distribución de Visualizaciones por Show de TV\n(Top {top_n} + Otros)', fontsize=16,
+                     fontweight='bold', pad=20)
+        ax.axis('equal')
+
+        # Agregar leyenda con información completa
+        ax.legend(wedges, legend_labels, title="Shows Detallados", loc="center left", bbox_to_anchor=(1, 0, 0.5, 1),
+                  fontsize=8)
+        fig.tight_layout()
+
+        # Guardar el gráfico en memoria
+        img_buffer = io.BytesIO()
+        fig.savefig(img_buffer, format='png', dpi=100)
+        img_buffer.seek(0)
+    return img_buffer
+
+
+def analizar_shows_por_visualizaciones(archivo_excel, archivo_salida="analisis_shows_tv.xlsx", top_n=20,
+                                       incluir_acumulado=True):
     """
     Analiza los shows de TV únicos ordenados por visualizaciones, incluyendo su género
 
@@ -15,6 +130,7 @@ def analizar_shows_por_visualizaciones(archivo_excel, archivo_salida="analisis_s
         archivo_excel (str): Ruta del archivo Excel de entrada
         archivo_salida (str): Nombre del archivo Excel de salida
         top_n (int): Número de shows top a incluir en el gráfico
+        incluir_acumulado (bool): Si se agrega la columna PORCENTAJE_ACUMULADO
     """
 
     try:
@@ -23,33 +139,10 @@ def analizar_shows_por_visualizaciones(archivo_excel, archivo_salida="analisis_s
             print(f"❌ Error: El archivo '{archivo_excel}' no existe.")
             return None
 
-        # Leer la hoja "Dataset"
-        try:
-            df = pd.read_excel(archivo_excel, sheet_name='Dataset')
-        except:
-            # Si no encuentra por nombre, intentar por índice (segunda hoja)
-            try:
-                df = pd.read_excel(archivo_excel, sheet_name=1)
-                print("⚠️  Hoja 'Dataset' no encontrada, usando la segunda hoja del archivo")
-            except Exception as e:
-                print(f"❌ Error al leer el archivo Excel: {e}")
-                return None
-
-        # Verificar si existen las columnas necesarias
-        columnas_requeridas = ['TITLE', 'GENRE']
-        for columna in columnas_requeridas:
-            if columna not in df.columns:
-                print(f"❌ Error: No se encontró la columna '{columna}' en la hoja")
-                print(f"Columnas disponibles: {list(df.columns)}")
-                return None
-
-        # Limpiar y preparar los datos
-        df_clean = df[['TITLE', 'GENRE']].copy()
-        df_clean['TITLE'] = df_clean['TITLE'].astype(str).str.strip()
-        df_clean['GENRE'] = df_clean['GENRE'].astype(str).str.strip()
-        df_clean = df_clean.dropna()
-        df_clean = df_clean[(df_clean['TITLE'] != '') & (df_clean['TITLE'] != 'nan')]
-        df_clean = df_clean[(df_clean['GENRE'] != '') & (df_clean['GENRE'] != 'nan')]
+        # Leer y limpiar las columnas necesarias (sin nulos ni vacíos, como categorías)
+        df_clean = load_cleaned_dataset(archivo_excel, ['TITLE', 'GENRE'], categoricas=('TITLE', 'GENRE'))
+        if df_clean is None:
+            return None
 
         # Calcular estadísticas generales
         total_visualizaciones = len(df_clean)
@@ -64,114 +157,98 @@ def analizar_shows_por_visualizaciones(archivo_excel, archivo_salida="analisis_s
         print(f"🎭 Géneros únicos: {generos_unicos}")
         print("=" * 70)
 
-        # Contar visualizaciones por show y género
-        conteo_shows = df_clean.groupby(['TITLE', 'GENRE']).size().reset_index(name='VISUALIZACIONES')
-
-        # Ordenar por visualizaciones (descendente)
-        conteo_shows = conteo_shows.sort_values('VISUALIZACIONES', ascending=False)
+        # Contar visualizaciones por show y género (solo combinaciones observadas) sobre
+        # los códigos de las categorías, en orden descendente
+        cat_titulos = df_clean['TITLE'].cat
+        cat_generos = df_clean['GENRE'].cat
+        codigos_titulo, codigos_genero, vistas = _contar_pares(
+            cat_titulos.codes.to_numpy(), cat_generos.codes.to_numpy(), len(cat_generos.categories))
+        conteo_shows = pd.DataFrame({
+            'TITLE': cat_titulos.categories[codigos_titulo].astype(str),
+            'GENRE': cat_generos.categories[codigos_genero].astype(str),
+            'VISUALIZACIONES': vistas
+        }).sort_values('VISUALIZACIONES', ascending=False, ignore_index=True)
 
         # Agregar porcentaje
         conteo_shows['PORCENTAJE'] = (conteo_shows['VISUALIZACIONES'] / total_visualizaciones * 100).round(4)
-        conteo_shows['PORCENTAJE_ACUMULADO'] = conteo_shows['PORCENTAJE'].cumsum()
+        if incluir_acumulado:
+            conteo_shows['PORCENTAJE_ACUMULADO'] = conteo_shows['PORCENTAJE'].cumsum()
 
         # Calcular estadísticas adicionales
         shows_top_10 = conteo_shows.head(10)
         porcentaje_top_10 = shows_top_10['PORCENTAJE'].sum()
 
-        # Encontrar el show más popular de cada género
-        top_show_por_genero = conteo_shows.loc[conteo_shows.groupby('GENRE')['VISUALIZACIONES'].idxmax()]
+        # Encontrar el show más popular de cada género: como conteo_shows ya está ordenado,
+        # es la primera fila de cada género (se listan en orden alfabético de género)
+        top_show_por_genero = conteo_shows.drop_duplicates(subset='GENRE', keep='first').sort_values('GENRE')
 
         print(f"🏆 TOP 10 SHOWS MÁS VISTOS ({porcentaje_top_10:.1f}% del total):")
         print("-" * 80)
-        for i, (_, row) in enumerate(shows_top_10.iterrows(), 1):
+        for i, row in enumerate(shows_top_10.itertuples(index=False), 1):
             print(
-                f"{i:2d}. {row['TITLE'][:40]:<40} [{row['GENRE']:<12}] {row['VISUALIZACIONES']:>6,} views ({row['PORCENTAJE']:.2f}%)")
+                f"{i:2d}. {row.TITLE[:40]:<40} [{row.GENRE:<12}] {row.VISUALIZACIONES:>6,} views ({row.PORCENTAJE:.2f}%)")
 
         print("=" * 70)
         print("🎯 SHOW MÁS POPULAR POR GÉNERO:")
         print("-" * 60)
-        for _, row in top_show_por_genero.iterrows():
-            print(f"• {row['GENRE']:<15}: {row['TITLE'][:30]:<30} ({row['VISUALIZACIONES']:,} views)")
+        for row in top_show_por_genero.itertuples(index=False):
+            print(f"• {row.GENRE:<15}: {row.TITLE[:30]:<30} ({row.VISUALIZACIONES:,} views)")
 
         # Preparar datos para el gráfico de pastel
         if len(conteo_shows) > top_n:
-            # Agrupar shows menos populares en "Otros"
+            # Agrupar shows menos populares en "Otros" (se obtienen por diferencia con
+            # los totales, sin recorrer de nuevo la cola de conteo_shows si ya hay acumulado)
             top_shows = conteo_shows.head(top_n)
-            otros_visualizaciones = conteo_shows['VISUALIZACIONES'].iloc[top_n:].sum()
-            otros_porcentaje = conteo_shows['PORCENTAJE'].iloc[top_n:].sum()
-
-            datos_grafico = pd.concat([
-                top_shows[['TITLE', 'VISUALIZACIONES', 'PORCENTAJE']],
-                pd.DataFrame({
-                    'TITLE': ['Otros'],
-                    'VISUALIZACIONES': [otros_visualizaciones],
-                    'PORCENTAJE': [otros_porcentaje]
-                })
-            ])
-        else:
-            datos_grafico = conteo_shows.copy()
-
-        # Crear etiquetas para el gráfico
-        etiquetas = []
-        for _, row in datos_grafico.iterrows():
-            if row['TITLE'] == 'Otros':
-                etiquetas.append(f"Otros ({row['PORCENTAJE']:.1f}%)")
+            otros_visualizaciones = total_visualizaciones - top_shows['VISUALIZACIONES'].sum()
+            if incluir_acumulado:
+                porcentaje_acumulado = conteo_shows['PORCENTAJE_ACUMULADO']
+                porcentaje_acumulado_top = porcentaje_acumulado.iat[top_n - 1] if top_n > 0 else 0
+                otros_porcentaje = porcentaje_acumulado.iat[-1] - porcentaje_acumulado_top
             else:
-                etiqueta_corta = row['TITLE'][:15] + '...' if len(row['TITLE']) > 15 else row['TITLE']
-                etiquetas.append(f"{etiqueta_corta} ({row['PORCENTAJE']:.1f}%)")
-
-        # Crear gráfico de pastel
-        plt.figure(figsize=(14, 10))
-
-        colors = plt.cm.tab20c(range(len(datos_grafico)))
-        wedges, texts, autotexts = plt.pie(
-            datos_grafico['VISUALIZACIONES'],
-            labels=etiquetas,
-            autopct='%1.1f%%',
-            startangle=90,
-            colors=colors,
-            pctdistance=0.85,
-            textprops={'fontsize': 8}
-        )
-
-        # Mejorar la legibilidad
-        for autotext in autotexts:
-            autotext.set_color('white')
-            autotext.set_fontweight('bold')
-            autotext.set_fontsize(7)
-
-        plt.title(f'Distribución de Visualizaciones por Show de TV\n(Top {top_n} + Otros)', fontsize=16,
-                  fontweight='bold', pad=20)
-        plt.axis('equal')
-
-        # Agregar leyenda con información completa
-        legend_labels = []
-        for _, row in datos_grafico.iterrows():
-            if row['TITLE'] == 'Otros':
-                legend_labels.append(f"Otros: {row['VISUALIZACIONES']:,} views ({row['PORCENTAJE']:.2f}%)")
-            else:
-                # Encontrar el género del show
-                genero = conteo_shows[conteo_shows['TITLE'] == row['TITLE']]['GENRE'].iloc[0]
-                legend_labels.append(f"{row['TITLE']} [{genero}]: {row['VISUALIZACIONES']:,} views")
-
-        plt.legend(wedges, legend_labels, title="Shows Detallados", loc="center left", bbox_to_anchor=(1, 0, 0.5, 1),
-                   fontsize=8)
-
-        # Guardar el gráfico en memoria
-        img_buffer = io.BytesIO()
-        plt.savefig(img_buffer, format='png', dpi=300, bbox_inches='tight')
-        img_buffer.seek(0)
-        plt.close()
-
-        # Crear archivo Excel con análisis completo
-        with pd.ExcelWriter(archivo_salida, engine='openpyxl') as writer:
-            # Hoja 1: Shows ordenados por visualizaciones
-            conteo_shows.to_excel(writer, sheet_name='Shows por Visualizaciones', index=False)
+                otros_porcentaje = conteo_shows['PORCENTAJE'].iloc[top_n:].sum()
+
+            # Agregar la fila "Otros" al final de cada columna, sin concatenar DataFrames
+            datos_grafico = pd.DataFrame({
+                'TITLE': np.append(top_shows['TITLE'].to_numpy(), 'Otros'),
+                'VISUALIZACIONES': np.append(top_shows['VISUALIZACIONES'].to_numpy(), otros_visualizaciones),
+                'PORCENTAJE': np.append(top_shows['PORCENTAJE'].to_numpy(), otros_porcentaje)
+            })
+        else:
+            datos_grafico = conteo_shows
+
+        # Crear etiquetas para el gráfico con operaciones de texto vectorizadas
+        # ("Otros" es corto, así que queda igual que con la rama aparte)
+        titulos = datos_grafico['TITLE']
+        vistas_texto = datos_grafico['VISUALIZACIONES'].map('{:,}'.format)
+        es_otros = titulos == 'Otros'
+        titulos_cortos = titulos.where(titulos.str.len() <= 15, titulos.str[:15] + '...')
+        etiquetas = (titulos_cortos + ' (' + datos_grafico['PORCENTAJE'].map('{:.1f}%'.format) + ')').tolist()
+
+        # Crear textos de la leyenda con información completa
+        # (género de cada show: el de su primera fila, la de más visualizaciones)
+        primeras_filas = conteo_shows.drop_duplicates(subset='TITLE', keep='first')
+        genero_por_titulo = dict(zip(primeras_filas['TITLE'], primeras_filas['GENRE']))
+        leyenda_shows = titulos + ' [' + titulos.map(genero_por_titulo) + ']: ' + vistas_texto + ' views'
+        leyenda_otros = 'Otros: ' + vistas_texto + ' views (' + datos_grafico['PORCENTAJE'].map('{:.2f}%'.format) + ')'
+        legend_labels = leyenda_shows.where(~es_otros, leyenda_otros).tolist()
+
+        # Crear archivo Excel con análisis completo, mientras el gráfico se genera en otro hilo
+        with ThreadPoolExecutor(max_workers=1) as executor, excel_writer(archivo_salida) as writer:
+            futuro_grafico = executor.submit(_generar_grafico, datos_grafico, etiquetas, legend_labels, top_n)
+
+            # Hoja 1: Shows ordenados por visualizaciones (el gráfico se agrega al final)
+            worksheet_shows = write_sheet(writer, conteo_shows, 'Shows por Visualizaciones')
 
             # Hoja 2: Top shows por género
-            top_show_por_genero.to_excel(writer, sheet_name='Top por Género', index=False)
+            write_sheet(writer, top_show_por_genero, 'Top por Género')
 
             # Hoja 3: Estadísticas generales
+            titulo_top = conteo_shows['TITLE'].iat[0]
+            vistas_top = conteo_shows['VISUALIZACIONES'].iat[0]
+            porcentaje_top = conteo_shows['PORCENTAJE'].iat[0]
+            genero_top = conteo_shows.groupby('GENRE')['VISUALIZACIONES'].sum().idxmax()
+            porcentaje_top_20 = conteo_shows['PORCENTAJE'].head(20).sum()
+            shows_una_visualizacion = int((conteo_shows['VISUALIZACIONES'] == 1).sum())
             stats_data = {
                 'ESTADÍSTICA': [
                     'Total de visualizaciones',
@@ -190,55 +267,28 @@ def analizar_shows_por_visualizaciones(archivo_excel, archivo_salida="analisis_s
                     total_visualizaciones,
                     shows_unicos,
                     generos_unicos,
-                    conteo_shows.iloc[0]['TITLE'],
-                    conteo_shows.iloc[0]['VISUALIZACIONES'],
-                    f"{conteo_shows.iloc[0]['PORCENTAJE']:.4f}%",
-                    conteo_shows.groupby('GENRE')['VISUALIZACIONES'].sum().idxmax(),
-                    top_show_por_genero[top_show_por_genero['GENRE'] ==
-                                        conteo_shows.groupby('GENRE')['VISUALIZACIONES'].sum().idxmax()]['TITLE'].iloc[
-                        0],
-                    f"{conteo_shows.head(10)['PORCENTAJE'].sum():.2f}%",
-                    f"{conteo_shows.head(20)['PORCENTAJE'].sum():.2f}%",
-                    len(conteo_shows[conteo_shows['VISUALIZACIONES'] == 1])
+                    titulo_top,
+                    vistas_top,
+                    f"{porcentaje_top:.4f}%",
+                    genero_top,
+                    top_show_por_genero[top_show_por_genero['GENRE'] == genero_top]['TITLE'].iloc[0],
+                    f"{porcentaje_top_10:.2f}%",
+                    f"{porcentaje_top_20:.2f}%",
+                    shows_una_visualizacion
                 ]
             }
             df_stats = pd.DataFrame(stats_data)
-            df_stats.to_excel(writer, sheet_name='Estadísticas', index=False)
+            write_sheet(writer, df_stats, 'Estadísticas')
 
             # Hoja 4: Distribución por género (para contexto)
             distribucion_genero = df_clean['GENRE'].value_counts().reset_index()
             distribucion_genero.columns = ['GÉNERO', 'VISUALIZACIONES']
             distribucion_genero['PORCENTAJE'] = (
                         distribucion_genero['VISUALIZACIONES'] / total_visualizaciones * 100).round(2)
-            distribucion_genero.to_excel(writer, sheet_name='Distribución por Género', index=False)
-
-            # Obtener el workbook para agregar el gráfico
-            workbook = writer.book
-            worksheet = workbook['Shows por Visualizaciones']
-
-            # Insertar el gráfico en el Excel
-            img = Image(img_buffer)
-            img.width = 800
-            img.height = 600
-
-            # Agregar imagen después de los datos
-            max_row = len(conteo_shows) + 4
-            worksheet.add_image(img, f'F{max_row}')
-
-            # Ajustar anchos de columnas
-            for sheet_name in writer.sheets:
-                worksheet = writer.sheets[sheet_name]
-                for column in worksheet.columns:
-                    max_length = 0
-                    column_letter = column[0].column_letter
-                    for cell in column:
-                        try:
-                            if len(str(cell.value)) > max_length:
-                                max_length = len(str(cell.value))
-                        except:
-                            pass
-                    adjusted_width = min(max_length + 2, 50)
-                    worksheet.column_dimensions[column_letter].width = adjusted_width
+            write_sheet(writer, distribucion_genero, 'Distribución por Género')
+
+            # Agregar el gráfico después de los datos
+            insert_image(worksheet_shows, f'F{len(conteo_shows) + 4}', futuro_grafico.result(), 800, 600)
 
         print(f"\n💾 Archivo Excel generado: {archivo_salida}")
         print("📋 Hojas incluidas:")